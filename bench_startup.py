@@ -0,0 +1,95 @@
+"""Measure how long kubeyaml takes to start up and do a trivial edit.
+
+    python bench_startup.py                               # python -m kubeyaml
+    python bench_startup.py --script                      # python kubeyaml.py
+    python bench_startup.py --binary dist/kubeyaml/kubeyaml  # a frozen build
+
+This reports the wall-clock time for running an image update on a
+small manifest, and (when running with python) the modules that took
+longest to import, as given by `python -X importtime`.
+
+Run as a script, kubeyaml.py is compiled every time; run as a module,
+its bytecode is cached. So the difference between the first two is the
+cost of compiling it.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST = b'''---
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: helloworld
+  namespace: default
+spec:
+  template:
+    spec:
+      containers:
+      - name: greeter
+        image: quay.io/weaveworks/helloworld:master-a000001
+'''
+
+EDIT = ['image', '--namespace', 'default', '--kind', 'Deployment',
+        '--name', 'helloworld', '--container', 'greeter',
+        '--image', 'quay.io/weaveworks/helloworld:master-a000002']
+
+def wallclock(command, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command + EDIT, input=MANIFEST, cwd=HERE,
+                       stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times
+
+def importtime(command, top):
+    """Run the edit with -X importtime and return the slowest top-level
+    imports, as (cumulative microseconds, module)."""
+    proc = subprocess.run(
+        [command[0], '-X', 'importtime'] + command[1:] + EDIT, input=MANIFEST, cwd=HERE,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    imports = []
+    for line in proc.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Only the outermost imports, rather than those of their
+        # dependencies
+        if not name.startswith('  '):
+            imports.append((int(cumulative), name.strip()))
+    imports.sort(reverse=True)
+    return imports[:top]
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--binary', help='time this executable rather than running kubeyaml with python')
+    p.add_argument('--script', action='store_true', help='run kubeyaml.py as a script, rather than as a module')
+    p.add_argument('--runs', type=int, default=20)
+    p.add_argument('--top', type=int, default=10)
+    args = p.parse_args()
+
+    if args.binary:
+        command = [args.binary]
+    else:
+        if args.script:
+            command = [sys.executable, os.path.join(HERE, 'kubeyaml.py')]
+        else:
+            command = [sys.executable, '-m', 'kubeyaml']
+        print('Slowest imports (cumulative):')
+        for us, name in importtime(command, args.top):
+            print('  %8.1fms  %s' % (us / 1000.0, name))
+
+    times = wallclock(command, args.runs)
+    print('Wall clock over %d runs of %s:' % (args.runs, ' '.join(command)))
+    print('  min %.1fms  median %.1fms  max %.1fms' % (
+        times[0] * 1000, times[len(times) // 2] * 1000, times[-1] * 1000))
+
+if __name__ == '__main__':
+    main()
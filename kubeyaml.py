@@ -1,9 +1,22 @@
 import sys
-import argparse
+import os
+import io
 import functools
 import collections
-import re
-from ruamel.yaml import YAML
+import json
+import zlib
+import array
+
+# NB the program is run anew for every edit, so startup time
+# counts. Every edit needs ruamel.yaml and argparse; they're imported
+# where they're used only so that importing this module, and --help,
+# don't need both. The other big cost is compiling this file:
+# running it as a script (`python kubeyaml.py`) compiles it every
+# time, whereas `python -m kubeyaml`, the zipapp (`make zipapp`) and
+# the PyInstaller build use precompiled bytecode, so those are the
+# ways to run it that start quickly. Modules only some commands need
+# (e.g., asyncio for serve) are imported where they're used. See
+# bench_startup.py.
 
 # The container name, by proclamation, used for an image supplied in a
 # FluxHelmRelease
@@ -15,39 +28,111 @@ class NotFound(Exception):
 class UnresolvablePath(Exception):
     pass
 
-def parse_args():
-    p = argparse.ArgumentParser()
+class MemoryLimitExceeded(Exception):
+    pass
+
+class GitError(Exception):
+    pass
+
+class VerificationFailed(Exception):
+    pass
+
+COMMANDS = ['image', 'annotate', 'set', 'serve', 'index']
+OUTPUTS = ['yaml', 'diff', 'json-patch']
+
+def stream_options():
+    """Construct a parser with the options for all the edit commands
+    that are about the stream being edited, to be used as a parent of
+    the parser for each edit command."""
+    import argparse
+
+    def megabytes(s):
+        return int(s) * 1024 * 1024
+
+    stream = argparse.ArgumentParser(add_help=False)
+    stream.add_argument('--max-memory', type=megabytes, metavar='MB',
+                        help='fail if the peak memory used by the process exceeds this (checked between '
+                        'documents; since it is the peak, a large document will trip it for the rest of the stream). '
+                        'NB JSON input is not streamed, but read whole')
+    stream.add_argument('--recompress', action='store_true',
+                        help='if the input is compressed, compress the output in the same format')
+    stream.add_argument('--output', choices=OUTPUTS, default='yaml',
+                        help='write all the documents (yaml, the default), or only the changes made to them')
+    stream.add_argument('--verify', action='store_true',
+                        help='check that only the manifest to be edited has changed, and that it has the new value(s). '
+                        'The check is made as the output is written, so if it fails, the output has been written '
+                        'regardless, and only the exit status says so')
+    return stream
+
+def parser(command=None, parser_class=None):
+    """Construct the argument parser. If command is given, only its
+    subcommand is included; this saves building the others, when we
+    know they won't be used. If parser_class is given, it's used in
+    place of argparse.ArgumentParser."""
+    import argparse
+    p = (parser_class or argparse.ArgumentParser)()
     subparsers = p.add_subparsers()
+    stream = stream_options()
 
-    image = subparsers.add_parser('image', help='update an image ref')
-    image.add_argument('--namespace', required=True)
-    image.add_argument('--kind', required=True)
-    image.add_argument('--name', required=True)
-    image.add_argument('--container', required=True)
-    image.add_argument('--image', required=True)
-    image.set_defaults(func=update_image)
+    def wanted(name):
+        return command is None or command == name
 
     def keyValuePair(s):
         k, v = s.split('=')
         return k, v
 
-    annotation = subparsers.add_parser('annotate', help='update annotations')
-    annotation.add_argument('--namespace', required=True)
-    annotation.add_argument('--kind', required=True)
-    annotation.add_argument('--name', required=True)
-    annotation.add_argument('notes', nargs='+', type=keyValuePair)
-    annotation.set_defaults(func=update_annotations)
+    if wanted('image'):
+        image = subparsers.add_parser('image', help='update an image ref', parents=[stream])
+        image.add_argument('--namespace', required=True)
+        image.add_argument('--kind', required=True)
+        image.add_argument('--name', required=True)
+        image.add_argument('--container', required=True)
+        image.add_argument('--image', required=True)
+        image.set_defaults(func=update_image, check=verify_image)
 
-    set = subparsers.add_parser('set', help='update values by their dot notation paths')
-    set.add_argument('--namespace', required=True)
-    set.add_argument('--kind', required=True)
-    set.add_argument('--name', required=True)
-    set.add_argument('paths', nargs='+', type=keyValuePair)
-    set.set_defaults(func=set_paths)
+    if wanted('annotate'):
+        annotation = subparsers.add_parser('annotate', help='update annotations', parents=[stream])
+        annotation.add_argument('--namespace', required=True)
+        annotation.add_argument('--kind', required=True)
+        annotation.add_argument('--name', required=True)
+        annotation.add_argument('notes', nargs='+', type=keyValuePair)
+        annotation.set_defaults(func=update_annotations, check=verify_annotations)
 
-    return p.parse_args()
+    if wanted('set'):
+        set = subparsers.add_parser('set', help='update values by their dot notation paths', parents=[stream])
+        set.add_argument('--namespace', required=True)
+        set.add_argument('--kind', required=True)
+        set.add_argument('--name', required=True)
+        set.add_argument('paths', nargs='+', type=keyValuePair)
+        set.set_defaults(func=set_paths, check=verify_paths)
+
+    # These don't edit a stream, so have no func; run is given the
+    # args instead.
+    if wanted('serve'):
+        serve = subparsers.add_parser('serve', help='accept edits to files over a socket')
+        serve.add_argument('--socket', required=True)
+        serve.set_defaults(func=None, run=lambda args: serve_socket(args.socket))
+
+    if wanted('index'):
+        index = subparsers.add_parser('index', help='index the workloads in a git repo')
+        index.add_argument('--repo', default='.')
+        index.add_argument('--index', required=True, help='file to keep the index in')
+        index.add_argument('--rev', help='index this revision, read from git, rather than the working tree')
+        index.add_argument('--catalog', help='also write a compact catalog of the workloads to this file')
+        index.set_defaults(func=None, run=lambda args: index_repo(args.repo, args.index, args.rev, args.catalog))
+
+    return p
+
+def parse_args(argv=None, parser_class=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    command = None
+    if len(argv) > 0 and argv[0] in COMMANDS:
+        command = argv[0]
+    return parser(command, parser_class).parse_args(argv)
 
 def yaml():
+    from ruamel.yaml import YAML
     y = YAML()
     y.explicit_start = True
     y.explicit_end = False
@@ -68,13 +153,1016 @@ class AlwaysFalse(object):
     def __set__(self, instance, value):
         pass
 
-def apply_to_yaml(fn, infile, outfile):
+def apply_to_yaml(fn, infile, outfile, max_memory=None, verify=None):
     # fn :: iterator a -> iterator b
+    #
+    # Documents are processed one at a time: each is read, passed
+    # through fn, and written out (and flushed) before the next is
+    # read. So memory use depends on the size of the largest document,
+    # not on how many documents there are. If max_memory (in bytes) is
+    # given, the peak memory used is checked between documents.
+    #
+    # If verify (a Verifier) is given, it checks the edit once all the
+    # documents have been written.
     y = yaml()
     # Hack to make sure no end-of-document ("...") is ever added
     y.Emitter.open_ended = AlwaysFalse()
+    if verify is not None:
+        infile, outfile = verify.reader(infile), verify.writer(outfile)
+        fn = verify.wrap(fn)
     docs = y.load_all(infile)
-    y.dump_all(fn(docs), outfile)
+    y.dump_all(one_at_a_time(y, fn(docs), outfile, max_memory), outfile)
+    if verify is not None:
+        verify.finish()
+
+def one_at_a_time(y, docs, outfile, max_memory=None):
+    for doc in docs:
+        if max_memory is not None:
+            check_memory(max_memory)
+        yield doc
+        # By the time the next document is asked for, this one has
+        # been emitted; so drop it before reading the next.
+        del doc
+        outfile.flush()
+        # ruamel.yaml keeps a record of each document it has loaded
+        # (but only needs the latest)
+        doc_infos = getattr(y, 'doc_infos', None)
+        if doc_infos:
+            del doc_infos[:-1]
+
+def check_memory(max_memory):
+    """Raise MemoryLimitExceeded if the peak memory used by this process
+    is more than max_memory bytes."""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes, except on macOS where it's in bytes
+    if sys.platform != 'darwin':
+        peak = peak * 1024
+    if peak > max_memory:
+        raise MemoryLimitExceeded(peak, max_memory)
+
+def apply_to_yaml_changes(fn, spec, infile, outfile, style, max_memory=None):
+    """Like apply_to_yaml, but rather than writing out all the
+    documents, write only the changes fn made to the manifest(s)
+    matching spec: as a unified diff (style 'diff') or a line of JSON
+    with an RFC 6902 JSON patch (style 'json-patch') per manifest
+    changed."""
+    y = yaml()
+    before = []
+
+    def snapshot(docs):
+        # Record the manifests that fn may alter, before it does
+        for doc in docs:
+            for m in manifests(doc):
+                if match_manifest(spec, m):
+                    if style == 'diff':
+                        before.append((m, dump_manifest(m)))
+                    else:
+                        before.append((m, plain(m)))
+            yield doc
+
+    for doc in one_at_a_time(y, fn(snapshot(y.load_all(infile))), outfile, max_memory):
+        while before:
+            m, original = before.pop(0)
+            if style == 'diff':
+                outfile.write(manifest_diff(m, original))
+            else:
+                patch = json_patch(original, plain(m))
+                if patch:
+                    outfile.write(json_patch_line(m, patch))
+
+def resource_id(manifest):
+    """The identifier for a manifest, in the form Flux uses:
+    namespace:kind/name"""
+    return '%s:%s/%s' % (manifest['metadata'].get('namespace', 'default'),
+                         manifest['kind'].lower(), manifest['metadata']['name'])
+
+def dump_manifest(manifest):
+    from ruamel.yaml.compat import StringIO
+    out = StringIO()
+    y = yaml()
+    y.explicit_start = False
+    y.dump(manifest, out)
+    return out.getvalue()
+
+def manifest_diff(manifest, original):
+    import difflib
+    id = resource_id(manifest)
+    return ''.join(difflib.unified_diff(
+        original.splitlines(True), dump_manifest(manifest).splitlines(True),
+        fromfile='a/' + id, tofile='b/' + id))
+
+def json_patch_line(manifest, patch):
+    return json.dumps({'id': resource_id(manifest), 'patch': patch}) + '\n'
+
+def plain(value):
+    """Convert a value as loaded by ruamel.yaml into plain dicts, lists,
+    and scalars, so it can be compared and encoded as JSON."""
+    if isinstance(value, dict):
+        return {str(k): plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [plain(v) for v in value]
+    if value is None or isinstance(value, bool):
+        return value
+    for t in (str, int, float):
+        if isinstance(value, t):
+            return t(value)
+    return str(value)
+
+def json_patch(before, after, path=''):
+    """Calculate an RFC 6902 JSON patch that turns before into after."""
+    if isinstance(before, dict) and isinstance(after, dict):
+        ops = []
+        for k in before:
+            p = path + '/' + k.replace('~', '~0').replace('/', '~1')
+            if k not in after:
+                ops.append({'op': 'remove', 'path': p})
+            else:
+                ops.extend(json_patch(before[k], after[k], p))
+        for k in after:
+            if k not in before:
+                p = path + '/' + k.replace('~', '~0').replace('/', '~1')
+                ops.append({'op': 'add', 'path': p, 'value': after[k]})
+        return ops
+    if isinstance(before, list) and isinstance(after, list) and len(before) == len(after):
+        ops = []
+        for i, (b, a) in enumerate(zip(before, after)):
+            ops.extend(json_patch(b, a, '%s/%d' % (path, i)))
+        return ops
+    if before != after or type(before) != type(after):
+        return [{'op': 'replace', 'path': path, 'value': after}]
+    return []
+
+def sha1(data):
+    # NB hashlib loads OpenSSL, which takes a few milliseconds, and
+    # only --verify needs it
+    import hashlib
+    return hashlib.sha1(data)
+
+class DocumentHasher(object):
+    """Hashes the text of each document in a YAML stream, as it's given
+    in pieces, and calls done(digest, text) with the hash and text of
+    each document as it ends. The hashes are of the text as it is,
+    except that blank lines at the end of a document, any end of
+    document marker ("..."), and whether the first document has an
+    explicit start ("---") are ignored, since these are not kept when
+    the stream is written out again.
+    """
+    def __init__(self, done):
+        self.done = done
+        self.current = None
+        self.text = []
+        self.partial = ''
+        self.before = [] # lines before the next document
+        self.blanks = 0
+
+    def feed(self, text):
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.line(line + '\n')
+
+    def line(self, line):
+        if line == '---\n' or line.startswith('--- '):
+            self.start(line)
+            self.text.append(line)
+            return
+        elif line == '...\n':
+            return
+        elif line.startswith('%'):
+            # a directive, which belongs to the next document
+            self.end()
+            self.before.append(line)
+            return
+        elif self.current is None:
+            stripped = line.strip()
+            if stripped == '' or stripped.startswith('#'):
+                self.before.append(line)
+                return
+            self.start('---\n') # an implicit start
+        elif line.strip() == '':
+            self.blanks += 1
+            return
+        self.current.update(b'\n' * self.blanks + line.encode('utf-8'))
+        self.text.append('\n' * self.blanks + line)
+        self.blanks = 0
+
+    def start(self, marker):
+        # NB the marker is hashed before anything that came before it,
+        # since ruamel.yaml writes leading comments after the marker
+        self.end()
+        self.current = sha1(marker.encode('utf-8'))
+        for line in self.before:
+            self.current.update(line.encode('utf-8'))
+        self.text = self.before
+        self.before = []
+
+    def end(self):
+        if self.current is not None:
+            self.done(self.current.digest(), ''.join(self.text))
+        self.current = None
+        self.text = []
+        self.blanks = 0
+
+    def close(self):
+        if self.partial:
+            self.line(self.partial)
+            self.partial = ''
+        self.end()
+
+class HashingStream(object):
+    """Passes reads from, or writes to, stream through a DocumentHasher."""
+    def __init__(self, stream, hasher):
+        self.stream = stream
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hasher.feed(data)
+        return data
+
+    def write(self, data):
+        self.hasher.feed(data)
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+class Verifier(object):
+    """Checks an edit in the course of doing it, rather than by parsing
+    the input and output again afterwards: each document in the input
+    and the output is hashed, and only the document with the manifest
+    to be edited may differ. Within that document, if it's a List,
+    only the manifest to be edited may differ; and check(spec,
+    manifest) must be true of the manifest once edited.
+
+    The text of a document may change without its values changing,
+    since ruamel.yaml doesn't keep everything about how it's
+    formatted (e.g., the indentation of sequences, or extra spaces).
+    So when the text of a document differs, it's parsed again, from
+    the input and the output, and the values compared.
+    """
+    def __init__(self, spec, check):
+        self.spec = spec
+        self.check = check
+        self.input = DocumentHasher(functools.partial(self.hashed, 0))
+        self.output = DocumentHasher(functools.partial(self.hashed, 1))
+        self.pending = (collections.deque(), collections.deque()) # (digest, text) for input, output
+        self.compared = 0
+        self.changed = []
+        self.matched = {} # document index -> items before, for Lists
+
+    def reader(self, infile):
+        return HashingStream(infile, self.input)
+
+    def writer(self, outfile):
+        return HashingStream(outfile, self.output)
+
+    def wrap(self, fn, digest=None):
+        """Wrap fn (as given to apply_to_yaml) so that the documents
+        going in and coming out are checked. If digest is given, it's
+        used to hash the documents, rather than hashing their text as
+        it's read and written."""
+        def wrapped(docs):
+            return self.after(fn(self.before(docs, digest)), digest)
+        return wrapped
+
+    def before(self, docs, digest):
+        for i, doc in enumerate(docs):
+            for m in manifests(doc):
+                if match_manifest(self.spec, m):
+                    if doc['kind'].endswith('List'):
+                        self.matched[i] = plain(doc['items'])
+                    else:
+                        self.matched[i] = None
+                    break
+            if digest is not None:
+                self.hashed(0, None if i in self.matched else digest(doc), None)
+            yield doc
+
+    def after(self, docs, digest):
+        for i, doc in enumerate(docs):
+            if i in self.matched:
+                self.check_document(i, doc)
+            if digest is not None:
+                self.hashed(1, None if i in self.matched else digest(doc), None)
+            yield doc
+
+    def hashed(self, side, digest, text):
+        # Documents are compared as soon as both the input and the
+        # output of each is known, so only the text of the documents
+        # in between is kept.
+        self.pending[side].append((digest, text))
+        while self.pending[0] and self.pending[1]:
+            self.compare(self.compared, self.pending[0].popleft(), self.pending[1].popleft())
+            self.compared += 1
+
+    def compare(self, i, before, after):
+        from ruamel.yaml.error import YAMLError
+        if i in self.matched or before[0] == after[0]:
+            return
+        try:
+            if before[1] is not None and after[1] is not None and \
+               plain(yaml().load(before[1])) == plain(yaml().load(after[1])):
+                return
+        except YAMLError:
+            pass
+        self.changed.append(i)
+
+    def check_document(self, i, doc):
+        items = self.matched[i]
+        for j, m in enumerate(manifests(doc)):
+            if match_manifest(self.spec, m):
+                if not self.check(self.spec, m):
+                    raise VerificationFailed("document %d does not have the value(s) requested" % i)
+            elif items is not None and (j >= len(items) or plain(m) != items[j]):
+                raise VerificationFailed("item %d of document %d was changed" % (j, i))
+        if items is not None and len(doc['items']) != len(items):
+            raise VerificationFailed("items were added to or removed from document %d" % i)
+
+    def finish(self):
+        self.input.close()
+        self.output.close()
+        read, written = self.compared + len(self.pending[0]), self.compared + len(self.pending[1])
+        if read != written:
+            raise VerificationFailed("%d documents were read, but %d were written" % (read, written))
+        if self.changed:
+            raise VerificationFailed("document %d was changed" % self.changed[0])
+
+def json_digest(doc):
+    return sha1(json.dumps(doc, sort_keys=True).encode('utf-8')).digest()
+
+def verify_image(args, manifest):
+    c = find_container(args, manifest)
+    return c is not None and c['image'] == args.image
+
+def verify_annotations(spec, manifest):
+    notes = manifest['metadata'].get('annotations', {})
+    for k, v in spec.notes:
+        if v == '':
+            if k in notes:
+                return False
+        elif notes.get(k) != v:
+            return False
+    return True
+
+def verify_paths(spec, manifest):
+    for k, v in spec.paths:
+        d = manifest
+        try:
+            for key in k.split('.'):
+                d = d[key]
+        except (KeyError, TypeError):
+            return False
+        if d != v:
+            return False
+    return True
+
+def looks_like_json(infile):
+    """Guess whether the binary stream infile is JSON, from its first
+    non-space character. infile must support peek(), and is not
+    advanced."""
+    return infile.peek(64).lstrip()[:1] in (b'{', b'[')
+
+def json_style(text):
+    """Work out the arguments to json.dump that will format values in
+    the same style as text."""
+    import re
+    style = {'ensure_ascii': True}
+    try:
+        text.encode('ascii')
+    except UnicodeEncodeError:
+        style['ensure_ascii'] = False
+    indented = re.match(r'\s*[{\[]\n([ \t]*)', text)
+    if indented:
+        style['indent'] = indented.group(1)
+        item_sep = ','
+    else:
+        item_sep = ', ' if re.search(r'[}\]"\d],\s', text) else ','
+    key_sep = ': ' if re.search(r'":\s', text) else ':'
+    style['separators'] = (item_sep, key_sep)
+    return style
+
+def load_json_all(text):
+    """Return the JSON values in text, which may have more than one,
+    separated by whitespace."""
+    decoder = json.JSONDecoder()
+    docs, pos = [], 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos == len(text):
+            return docs
+        doc, pos = decoder.raw_decode(text, pos)
+        docs.append(doc)
+
+def dump_json_all(docs, outfile, style, end='\n'):
+    """Write each of docs as JSON, formatted according to style (as
+    from json_style), with a newline between each; and end after the
+    last."""
+    sep = ''
+    for doc in docs:
+        outfile.write(sep)
+        json.dump(doc, outfile, **style)
+        sep = '\n'
+    if sep:
+        outfile.write(end)
+
+def json_end(text):
+    """Return what to write after the last document, to match text."""
+    return '\n' if text.endswith('\n') else ''
+
+def apply_to_json(fn, infile, outfile, max_memory=None, verify=None):
+    """Like apply_to_yaml, but for JSON. The JSON is loaded with the
+    standard library parser, which is much faster than ruamel.yaml, and
+    written out in the same style it came in (including whether it
+    ends with a newline). Since JSON must be parsed all at once, the
+    input is read all at once, so memory use depends on the size of
+    the whole input; if max_memory is given, it's checked once the
+    input has been read and parsed. If the input doesn't turn out to
+    be JSON, it's treated as YAML."""
+    text = infile.read()
+    if max_memory is not None:
+        check_memory(max_memory)
+    try:
+        docs = load_json_all(text)
+    except ValueError:
+        from ruamel.yaml.compat import StringIO
+        apply_to_yaml(fn, StringIO(text), outfile, max_memory=max_memory, verify=verify)
+        return
+    if max_memory is not None:
+        check_memory(max_memory)
+    if verify is not None:
+        fn = verify.wrap(fn, digest=json_digest)
+    dump_json_all(fn(iter(docs)), outfile, json_style(text), json_end(text))
+    if verify is not None:
+        verify.finish()
+
+def apply_all_to_yaml(fns, infile, outfile):
+    """Apply each of fns (as for apply_to_yaml) in turn to the documents
+    in infile, parsing and emitting only once. Returns a list with,
+    for each fn, None if it succeeded or the exception it raised. A fn
+    that fails has no effect on the output; if they all fail, nothing
+    is written. JSON is read and written as JSON.
+    """
+    y = yaml()
+    y.Emitter.open_ended = AlwaysFalse()
+    original = infile.read()
+    style = None
+    if original.lstrip()[:1] in ('{', '['):
+        try:
+            load_json_all(original)
+            style = json_style(original)
+        except ValueError:
+            pass # treat it as YAML
+
+    def load():
+        if style is None:
+            return list(y.load_all(original))
+        return load_json_all(original)
+
+    def dump(docs, outfile):
+        if style is None:
+            y.dump_all(docs, outfile)
+        else:
+            dump_json_all(docs, outfile, style, json_end(original))
+
+    errors = [None] * len(fns)
+    while True:
+        # If a fn fails part way through, it may have left some
+        # documents altered; so start again without it.
+        docs = load()
+        for i, fn in enumerate(fns):
+            if errors[i] is not None:
+                continue
+            try:
+                docs = list(fn(docs))
+            except Exception as e:
+                errors[i] = e
+                break
+        else:
+            break
+    if any(e is None for e in errors):
+        dump(docs, outfile)
+    return errors
+
+# The magic bytes at the start of a compressed stream, for each
+# compression format understood
+COMPRESSION_MAGIC = {
+    'gzip': b'\x1f\x8b',
+    'bz2': b'BZh',
+    'xz': b'\xfd7zXZ\x00',
+}
+
+def compression(infile):
+    """Return the compression format of the binary stream infile, or
+    None if it's not compressed. infile must support peek(), and is
+    not advanced."""
+    start = infile.peek(6)
+    for fmt, magic in COMPRESSION_MAGIC.items():
+        if start.startswith(magic):
+            return fmt
+    return None
+
+def compressed_file(fmt, fileobj, mode):
+    if fmt == 'gzip':
+        import gzip
+        return gzip.GzipFile(fileobj=fileobj, mode=mode)
+    if fmt == 'bz2':
+        import bz2
+        return bz2.BZ2File(fileobj, mode=mode)
+    if fmt == 'xz':
+        import lzma
+        return lzma.LZMAFile(fileobj, mode=mode)
+    return fileobj
+
+def open_input(infile):
+    """Return a text stream of the contents of the binary stream infile,
+    decompressing it as it's read if need be; and the compression
+    format, or None."""
+    if not hasattr(infile, 'peek'):
+        infile = io.BufferedReader(infile)
+    fmt = compression(infile)
+    return io.TextIOWrapper(compressed_file(fmt, infile, 'rb'), encoding='utf-8'), fmt
+
+def open_output(outfile, fmt):
+    """Return a text stream that writes to the binary stream outfile,
+    compressing in the format fmt (unless that's None). If compressed,
+    closing the text stream writes the end of the compressed stream,
+    but leaves outfile open."""
+    return io.TextIOWrapper(compressed_file(fmt, outfile, 'wb'), encoding='utf-8')
+
+def edit_file(path, fns):
+    """Apply fns to the file at path, as for apply_all_to_yaml, then
+    replace the file with the result. A compressed file stays
+    compressed in the same format, and the file keeps its
+    permissions."""
+    import shutil
+    tmp = '%s.kubeyaml-tmp' % path
+    try:
+        with open(path, 'rb') as rawin, open(tmp, 'wb') as rawout:
+            infile, fmt = open_input(rawin)
+            with open_output(rawout, fmt) as outfile:
+                errors = apply_all_to_yaml(fns, infile, outfile)
+        if any(e is None for e in errors):
+            shutil.copymode(path, tmp)
+            os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return errors
+
+class EditQueue(object):
+    """Queues edits per file, so that edits to the same file are never
+    run concurrently; and, all the edits that arrive while a file is
+    being written are applied together in the next parse and emit.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.running = {}
+
+    def submit(self, path, fn):
+        """Queue fn to be applied to the file at path. Returns a future
+        that resolves to None, or fails with the exception fn raised."""
+        path = os.path.abspath(path)
+        import asyncio
+        result = asyncio.get_event_loop().create_future()
+        self.pending.setdefault(path, []).append((fn, result))
+        if path not in self.running:
+            self.running[path] = asyncio.ensure_future(self.drain(path))
+        return result
+
+    async def drain(self, path):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        try:
+            while path in self.pending:
+                batch = self.pending.pop(path)
+                fns = [fn for fn, _ in batch]
+                try:
+                    errors = await loop.run_in_executor(None, edit_file, path, fns)
+                except Exception as e:
+                    errors = [e] * len(batch)
+                for (_, result), e in zip(batch, errors):
+                    if e is None:
+                        result.set_result(None)
+                    else:
+                        result.set_exception(e)
+        finally:
+            del self.running[path]
+
+def describe_error(e):
+    if isinstance(e, NotFound):
+        return "manifest not found"
+    if isinstance(e, UnresolvablePath):
+        return "unable to resolve path(s):\n" + '\n'.join(e.args[0])
+    if isinstance(e, MemoryLimitExceeded):
+        return "memory limit of %dMB exceeded" % (e.args[1] // (1024 * 1024))
+    if isinstance(e, MemoryError):
+        return "out of memory"
+    if isinstance(e, GitError):
+        return "git failed: " + e.args[0]
+    if isinstance(e, VerificationFailed):
+        return "verification failed: " + e.args[0]
+    return str(e)
+
+def request_parser_class():
+    """Return an argument parser class that, rather than printing usage
+    or help and exiting, raises ValueError with what it would have
+    printed; for parsing the arguments given in a request, so they
+    don't end up in the server's output."""
+    import argparse
+    messages = []
+
+    class RequestArgumentParser(argparse.ArgumentParser):
+        def print_usage(self, file=None):
+            messages.append(self.format_usage())
+
+        def print_help(self, file=None):
+            messages.append(self.format_help())
+
+        def exit(self, status=0, message=None):
+            if message:
+                messages.append(message)
+            raise ValueError(''.join(messages).strip())
+
+    return RequestArgumentParser
+
+async def handle_edit(queue, line):
+    """Handle a single request, which is a JSON object giving the file
+    to edit and the command-line arguments for the edit, e.g.,
+
+        {"id": 1, "file": "deploy.yaml", "args": ["image", "--namespace", ...]}
+    """
+    response = {}
+    try:
+        req = json.loads(line)
+        response['id'] = req.get('id')
+        args = parse_args(req['args'], request_parser_class())
+        if args.func is None:
+            raise ValueError("not an edit: %s" % req['args'][0])
+        # serve mode edits files, so the options about editing a
+        # stream don't apply
+        defaults = vars(stream_options().parse_args([]))
+        unsupported = ['--' + dest.replace('_', '-') for dest, default in defaults.items()
+                       if getattr(args, dest) != default]
+        if unsupported:
+            raise ValueError("not supported in serve mode: %s" % ' '.join(unsupported))
+        await queue.submit(req['file'], functools.partial(args.func, args))
+        response['ok'] = True
+    except Exception as e:
+        response['ok'] = False
+        response['error'] = describe_error(e)
+    return response
+
+def serve_socket(socket_path):
+    """Accept edits as lines of JSON over a unix socket, responding to
+    each with a line of JSON, in the order the edits complete."""
+    import asyncio
+    queue = EditQueue()
+
+    async def connection(reader, writer):
+        async def respond(line):
+            response = await handle_edit(queue, line)
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+
+        tasks = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                tasks.append(asyncio.ensure_future(respond(line.decode('utf-8'))))
+        if tasks:
+            await asyncio.wait(tasks)
+        await writer.drain()
+        writer.close()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(asyncio.start_unix_server(connection, path=socket_path))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+def git(repo, *args, **kwargs):
+    """Run git in repo, and return its output as bytes."""
+    import subprocess
+    proc = subprocess.run(['git', '-C', repo] + list(args), input=kwargs.get('input'),
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise GitError(proc.stderr.decode('utf-8', 'replace').strip())
+    return proc.stdout
+
+YAML_PATHSPECS = ['*.yaml', '*.yml']
+
+def git_listing(repo, rev=None):
+    """Return a dict of path -> blob hash, for the YAML files in the
+    given revision, or if rev is None, the files tracked in the
+    working tree (as recorded in git's index)."""
+    if rev is None:
+        # <mode> SP <blob> SP <stage> TAB <path>
+        out = git(repo, 'ls-files', '-s', '-z', '--', *YAML_PATHSPECS)
+    else:
+        # <mode> SP <type> SP <blob> TAB <path>; NB ls-tree doesn't
+        # do wildcards, so the paths are filtered below
+        out = git(repo, 'ls-tree', '-r', '-z', rev)
+    listing = {}
+    for entry in out.decode('utf-8').split('\0'):
+        if entry:
+            info, path = entry.split('\t', 1)
+            if not path.endswith(('.yaml', '.yml')):
+                continue
+            fields = info.split(' ')
+            listing[path] = fields[1] if rev is None else fields[2]
+    return listing
+
+def git_blobs(repo, blobs):
+    """Return the contents of each of the blobs (given by hash)."""
+    if len(blobs) == 0:
+        return []
+    out = git(repo, 'cat-file', '--batch', input=''.join(b + '\n' for b in blobs).encode('utf-8'))
+    contents = []
+    pos = 0
+    for _ in blobs:
+        # <blob> SP <type> SP <size> LF <contents> LF
+        eol = out.index(b'\n', pos)
+        size = int(out[pos:eol].split(b' ')[2])
+        contents.append(out[eol + 1:eol + 1 + size])
+        pos = eol + 1 + size + 1
+    return contents
+
+def index_workloads(infile):
+    """Return an entry for each workload in the YAML stream infile,
+    giving its identity, where it is in the stream, and its
+    containers."""
+    from ruamel.yaml.error import YAMLError
+    entries = []
+    try:
+        for d, doc in enumerate(yaml().load_all(infile)):
+            try:
+                is_list = doc['kind'].endswith('List')
+                for i, m in enumerate(manifests(doc)):
+                    try:
+                        cs = [[c['name'], c['image']] for c in containers(m)]
+                    except (KeyError, TypeError):
+                        continue # not a workload
+                    entries.append({
+                        'id': resource_id(m),
+                        'doc': d,
+                        'item': i if is_list else None,
+                        'containers': cs,
+                    })
+            except (KeyError, TypeError, AttributeError):
+                pass # not a manifest
+    except (YAMLError, UnicodeDecodeError):
+        pass # not YAML that can be parsed; there may be templates, for instance
+    return entries
+
+def update_index(repo, index=None, rev=None):
+    """Bring the index (from a previous run, or None to start afresh) up
+    to date with the repo at rev, or if rev is None, with its working
+    tree. Only files that have changed since the previous run are
+    read; which those are is determined by comparing the blob hashes
+    git has for the files, with those recorded in the index.
+    """
+    files = dict(index['files']) if index is not None else {}
+    listing = git_listing(repo, rev)
+    dirty = set()
+    if rev is None:
+        # Files changed in the working tree, but not (yet) in git's
+        # index, have the wrong blob hash in the listing. NB
+        # --relative, so that the paths are relative to repo (as
+        # with ls-files), even if it's a subdirectory.
+        dirty = set(git(repo, 'diff', '--relative', '--name-only', '-z', '--',
+                        *YAML_PATHSPECS).decode('utf-8').split('\0'))
+    for path in list(files):
+        if path not in listing:
+            del files[path]
+    changed = [path for path, blob in listing.items()
+               if path in dirty or path not in files or files[path]['blob'] != blob]
+
+    if rev is None:
+        for path in changed:
+            if not os.path.exists(os.path.join(repo, path)):
+                files.pop(path, None) # deleted, but not yet in git's index
+                continue
+            with open(os.path.join(repo, path), 'rb') as f:
+                infile, _ = open_input(f)
+                workloads = index_workloads(infile)
+            # If the file is dirty, what was read doesn't correspond
+            # to the blob; so make sure it's read again next time.
+            blob = None if path in dirty else listing[path]
+            files[path] = {'blob': blob, 'workloads': workloads}
+    else:
+        contents = git_blobs(repo, [listing[path] for path in changed])
+        for path, content in zip(changed, contents):
+            infile, _ = open_input(io.BytesIO(content))
+            files[path] = {'blob': listing[path], 'workloads': index_workloads(infile)}
+
+    commit = git(repo, 'rev-parse', rev or 'HEAD').decode('utf-8').strip()
+    return {'commit': commit, 'files': files}, changed
+
+def index_repo(repo, index_path, rev=None, catalog_path=None):
+    """Update the index kept in the file at index_path (creating it if
+    necessary), for the repo; and if catalog_path is given, write a
+    catalog of the workloads in the index there."""
+    index = None
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    index, _ = update_index(repo, index, rev)
+    tmp = '%s.kubeyaml-tmp' % index_path
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+    if catalog_path is not None:
+        tmp = '%s.kubeyaml-tmp' % catalog_path
+        with open(tmp, 'wb') as f:
+            f.write(catalog_bytes(index))
+        os.replace(tmp, catalog_path)
+
+# A catalog is a compact, read-only form of the workloads in an index,
+# for answering "where is this workload, and what images does it run"
+# without holding a manifest (or even a dict) per workload. It's laid
+# out so that it can be used directly from a memory-mapped file:
+#
+#     magic            b'KYC1'
+#     header           uint32 x 4: #strings, #string bytes, #workloads, #containers
+#     string offsets   uint32 x (#strings + 1)
+#     string data      UTF-8, padded to a multiple of four bytes
+#     workloads        uint32 x 8 per workload: namespace, kind, name, path,
+#                      doc, item + 1 (or 0 if not in a List), first container,
+#                      number of containers
+#     containers       uint32 x 2 per container: name, image
+#     lookup table     uint32 x (power of two >= 2 * #workloads): a hash
+#                      table of workload + 1 (or 0 if empty), keyed on
+#                      the crc32 of the workload's ID, with linear probing
+#
+# Strings (including namespace etc.) are indexes into the string
+# table, so each distinct string is stored once. Integers are
+# little-endian.
+
+CATALOG_MAGIC = b'KYC1'
+WORKLOAD_FIELDS = 8
+
+def catalog_key(namespace, kind, name):
+    return zlib.crc32(('%s:%s/%s' % (namespace, kind.lower(), name)).encode('utf-8'))
+
+def table_size(count):
+    size = 1
+    while size < count * 2:
+        size = size * 2
+    return size
+
+def uint32s(values):
+    a = array.array('I', values)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a.tobytes()
+
+def catalog_bytes(index):
+    """Encode the workloads in index as a catalog."""
+    strings, interned = [], {}
+    def intern(s):
+        if s not in interned:
+            interned[s] = len(strings)
+            strings.append(s.encode('utf-8'))
+        return interned[s]
+
+    workloads, containers, keys = [], [], []
+    for path, f in index['files'].items():
+        for w in f['workloads']:
+            namespace, rest = w['id'].split(':', 1)
+            kind, name = rest.split('/', 1)
+            item = 0 if w['item'] is None else w['item'] + 1
+            workloads.extend([intern(namespace), intern(kind), intern(name), intern(path),
+                              w['doc'], item, len(containers) // 2, len(w['containers'])])
+            for cname, image in w['containers']:
+                containers.extend([intern(cname), intern(image)])
+            keys.append(catalog_key(namespace, kind, name))
+
+    table = [0] * table_size(len(keys))
+    for i, key in enumerate(keys):
+        slot = key & (len(table) - 1)
+        while table[slot] != 0:
+            slot = (slot + 1) & (len(table) - 1)
+        table[slot] = i + 1
+
+    offsets = [0]
+    for s in strings:
+        offsets.append(offsets[-1] + len(s))
+    data = b''.join(strings)
+    data += b'\0' * (-len(data) % 4)
+    return b''.join([
+        CATALOG_MAGIC,
+        uint32s([len(strings), offsets[-1], len(keys), len(containers) // 2]),
+        uint32s(offsets), data, uint32s(workloads), uint32s(containers), uint32s(table),
+    ])
+
+class Workload(object):
+    """A workload, as found in a catalog."""
+    __slots__ = ('namespace', 'kind', 'name', 'path', 'doc', 'item', 'containers')
+
+    def __init__(self, namespace, kind, name, path, doc, item, containers):
+        self.namespace = namespace
+        self.kind = kind
+        self.name = name
+        self.path = path
+        self.doc = doc
+        self.item = item
+        self.containers = containers
+
+    def __repr__(self):
+        return "Workload(%s:%s/%s in %s)" % (self.namespace, self.kind, self.name, self.path)
+
+class Catalog(object):
+    """Read access to a catalog, as encoded by catalog_bytes. Nothing is
+    decoded until it's asked for, so opening a catalog (even a large
+    one) takes next to no time or memory."""
+
+    def __init__(self, buf):
+        buf = memoryview(buf)
+        if buf[:4].tobytes() != CATALOG_MAGIC:
+            raise ValueError("not a catalog")
+        self.buf = buf
+        pos = 4
+        def section(count, pos):
+            words = buf[pos:pos + count * 4]
+            if sys.byteorder != 'little':
+                words = array.array('I', words.tobytes())
+                words.byteswap()
+                return words, pos + count * 4
+            return words.cast('I'), pos + count * 4
+        header, pos = section(4, pos)
+        nstrings, nbytes, nworkloads, ncontainers = header
+        self.offsets, pos = section(nstrings + 1, pos)
+        self.data = buf[pos:pos + nbytes]
+        pos += nbytes + (-nbytes % 4)
+        self.workloads, pos = section(nworkloads * WORKLOAD_FIELDS, pos)
+        self.containers, pos = section(ncontainers * 2, pos)
+        self.table, pos = section(table_size(nworkloads), pos)
+        self.file = None
+
+    @staticmethod
+    def open(path):
+        """Open the catalog in the file at path, by memory-mapping it."""
+        import mmap
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        catalog = Catalog(m)
+        catalog.file = m
+        return catalog
+
+    def close(self):
+        # The views into the mapped file must go before it can be closed
+        self.buf = self.offsets = self.data = None
+        self.workloads = self.containers = self.table = None
+        if self.file is not None:
+            self.file.close()
+
+    def string(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __len__(self):
+        return len(self.workloads) // WORKLOAD_FIELDS
+
+    def __getitem__(self, i):
+        row = self.workloads[i * WORKLOAD_FIELDS:(i + 1) * WORKLOAD_FIELDS]
+        ns, kind, name, path, doc, item, first, count = row
+        containers = [(self.string(self.containers[c * 2]), self.string(self.containers[c * 2 + 1]))
+                      for c in range(first, first + count)]
+        return Workload(self.string(ns), self.string(kind), self.string(name), self.string(path),
+                        doc, None if item == 0 else item - 1, containers)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def lookup(self, kind, namespace, name):
+        """Return the Workload with the given identity, or None."""
+        kind = kind.lower()
+        mask = len(self.table) - 1
+        slot = catalog_key(namespace, kind, name) & mask
+        # compare encoded strings, to save decoding those in the catalog
+        want = [namespace.encode('utf-8'), kind.encode('utf-8'), name.encode('utf-8')]
+        offsets, data, workloads = self.offsets, self.data, self.workloads
+        while self.table[slot] != 0:
+            i = self.table[slot] - 1
+            row = i * WORKLOAD_FIELDS
+            for field in (2, 1, 0):
+                s = workloads[row + field]
+                if data[offsets[s]:offsets[s + 1]] != want[field]:
+                    break
+            else:
+                return self[i]
+            slot = (slot + 1) & mask
+        return None
 
 def update_image(args, docs):
     """Update the manifest specified by args, in the stream of docs"""
@@ -240,6 +1328,7 @@ def set_fluxhelmrelease_container(manifest, container, replace):
     # The logic within this method (almost) equals:
     # https://github.com/weaveworks/flux/blob/5b15a94397d58b69a2daedae3bcc377e4901435b/image/image.go#L136
     def parse_ref():
+        import re
         reg, im, tag = '', '', ''
         try:
             segments = replace.split('/')
@@ -302,12 +1391,37 @@ def set_fluxhelmrelease_container(manifest, container, replace):
 
 def main():
     args = parse_args()
+    if args.func is None:
+        try:
+            args.run(args)
+        except GitError as e:
+            bail(describe_error(e))
+        return
+    infile, outfile = sys.stdin, sys.stdout
+    fmt = compression(sys.stdin.buffer)
+    if fmt is not None:
+        infile, _ = open_input(sys.stdin.buffer)
+        if args.recompress:
+            outfile = open_output(sys.stdout.buffer, fmt)
+    verify = None
+    if args.verify:
+        if args.output != 'yaml':
+            bail("--verify can only be used with --output yaml")
+        verify = Verifier(args, args.check)
     try:
-        apply_to_yaml(functools.partial(args.func, args), sys.stdin, sys.stdout)
-    except NotFound:
-        bail("manifest not found")
-    except UnresolvablePath as e:
-        bail("unable to resolve path(s):\n" + '\n'.join(e.args[0]))
+        fn = functools.partial(args.func, args)
+        if args.output == 'yaml' and looks_like_json(infile.buffer):
+            apply_to_json(fn, infile, outfile, max_memory=args.max_memory, verify=verify)
+        elif args.output == 'yaml':
+            apply_to_yaml(fn, infile, outfile, max_memory=args.max_memory, verify=verify)
+        else:
+            apply_to_yaml_changes(fn, args, infile, outfile, args.output,
+                                  max_memory=args.max_memory)
+    except (NotFound, UnresolvablePath, MemoryLimitExceeded, MemoryError, VerificationFailed) as e:
+        bail(describe_error(e))
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+"""Generate corpora of Kubernetes YAML, for load testing and
+benchmarking kubeyaml.
+
+This uses the hypothesis strategies from test_kubeyaml.py, so the
+manifests are the same shapes the tests check kubeyaml against;
+comments are sprinkled through the YAML, and string values are
+quoted in a mix of styles. The output is determined by the seed
+(and the version of hypothesis).
+
+Drawing examples from hypothesis is slow, so large corpora are made
+from a pool of examples, copied and renamed as needed.
+
+    python kubeyaml_gen.py repo --files 1000 --out ./corpus
+    python kubeyaml_gen.py stream --docs 10000 > stream.yaml
+    python kubeyaml_gen.py list --items 10000 > list.yaml
+    python kubeyaml_gen.py helm --releases 100 --depth 12 > helm.yaml
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+
+from hypothesis import given, seed, settings, HealthCheck, Phase, strategies as strats
+from ruamel.yaml.compat import StringIO
+from ruamel.yaml.scalarstring import SingleQuotedScalarString, DoubleQuotedScalarString
+
+import kubeyaml
+from test_kubeyaml import documents, resources, comment_yaml, ids, custom_kinds, \
+    resource, dns_labels, toplevel_image_values, values_noise
+
+quoting_styles = strats.sampled_from([str, SingleQuotedScalarString, DoubleQuotedScalarString])
+
+def quote_strings(draw, value):
+    """Give each string value (but not key) in value a quoting style,
+    and drop the `_containers` entries the test strategies use for
+    bookkeeping."""
+    if isinstance(value, dict):
+        return {k: quote_strings(draw, v) for k, v in value.items() if k != '_containers'}
+    if isinstance(value, list):
+        return [quote_strings(draw, v) for v in value]
+    if isinstance(value, str):
+        return draw(quoting_styles)(value)
+    return value
+
+def dump(doc):
+    out = StringIO()
+    kubeyaml.yaml().dump(doc, out)
+    return out.getvalue()
+
+def draw_pool(strategy, size, seed_value):
+    """Draw size examples from strategy, along with the draws that
+    decide where comments go when it's rendered. The same seed gives
+    the same pool."""
+    pool = []
+    attempt = 0
+    while len(pool) < size:
+        # hypothesis may give up early, e.g., if too many examples are
+        # rejected; so keep going with a new seed until we have enough
+        @seed(seed_value + attempt)
+        @settings(max_examples=size - len(pool), database=None, deadline=None,
+                  phases=[Phase.generate], suppress_health_check=list(HealthCheck))
+        @given(strategy, strats.data())
+        def collect(doc, data):
+            doc = quote_strings(data.draw, doc)
+            comments = []
+            def record(strategy):
+                comments.append(data.draw(strategy))
+                return comments[-1]
+            comment_yaml(record, dump(doc))
+            pool.append((doc, comments))
+        collect()
+        attempt += 1
+    return pool[:size]
+
+def rename(doc, suffix):
+    """Give each manifest in doc a name ending with suffix, so that
+    copies of the same doc have distinct identities."""
+    for m in kubeyaml.manifests(doc):
+        name = m['metadata']['name']
+        m['metadata']['name'] = type(name)('%s-%s' % (name[:50], suffix))
+
+def generate(strategy, count, seed_value, pool_size):
+    """Generate count commented YAML documents from strategy. Drawing
+    from hypothesis is slow, so at most pool_size examples are drawn,
+    and further documents are renamed copies of those."""
+    rand = random.Random(seed_value)
+    pool = draw_pool(strategy, min(count, pool_size), seed_value)
+    for i in range(count):
+        if i < len(pool):
+            doc, comments = pool[i]
+        else:
+            doc, comments = rand.choice(pool)
+            doc = copy.deepcopy(doc)
+            rename(doc, i)
+        draws = iter(comments)
+        yield comment_yaml(lambda _: next(draws, None), dump(doc))
+
+def nested_values(depth):
+    """Helm values with images buried depth levels down, among noise."""
+    values = strats.builds(lambda ims, noise: dict(noise, **ims),
+                           toplevel_image_values, values_noise)
+    for _ in range(depth):
+        values = strats.builds(lambda k, v, noise: dict(noise, **{k: v}),
+                               dns_labels, values, values_noise)
+    return values
+
+def helm_releases(depth):
+    def release(id, chart, values):
+        base = resource(*id)
+        base['spec'] = {'chartGitPath': chart, 'values': values}
+        return base
+    return strats.builds(release, ids(custom_kinds), dns_labels, nested_values(depth))
+
+def write_stream(docs, out):
+    for doc in docs:
+        out.write(doc)
+
+def write_repo(docs, directory, files, seed_value):
+    """Distribute docs among files, with between one document and a few
+    documents per file."""
+    docs = list(docs)
+    rand = random.Random(seed_value)
+    os.makedirs(directory, exist_ok=True)
+    cuts = sorted(rand.sample(range(1, len(docs)), files - 1))
+    for i, (start, end) in enumerate(zip([0] + cuts, cuts + [len(docs)])):
+        with open(os.path.join(directory, 'manifest-%05d.yaml' % i), 'w') as f:
+            write_stream(docs[start:end], f)
+
+def parse_args():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--seed', type=int, default=0)
+    common.add_argument('--pool', type=int, default=200,
+                        help='draw at most this many examples from hypothesis')
+
+    p = argparse.ArgumentParser()
+    subparsers = p.add_subparsers(dest='mode')
+    subparsers.required = True
+
+    repo = subparsers.add_parser('repo', help='a directory of files, each with a few documents', parents=[common])
+    repo.add_argument('--files', type=int, required=True)
+    repo.add_argument('--docs-per-file', type=int, default=3)
+    repo.add_argument('--out', required=True)
+
+    stream = subparsers.add_parser('stream', help='a stream of documents', parents=[common])
+    stream.add_argument('--docs', type=int, required=True)
+
+    lst = subparsers.add_parser('list', help='a single List document', parents=[common])
+    lst.add_argument('--items', type=int, required=True)
+
+    helm = subparsers.add_parser('helm', help='a stream of HelmReleases with deeply nested values',
+                                 parents=[common])
+    helm.add_argument('--releases', type=int, required=True)
+    helm.add_argument('--depth', type=int, default=8)
+
+    return p.parse_args()
+
+def main():
+    args = parse_args()
+    if args.mode == 'repo':
+        docs = generate(documents, args.files * args.docs_per_file, args.seed, args.pool)
+        write_repo(docs, args.out, args.files, args.seed)
+    elif args.mode == 'stream':
+        write_stream(generate(documents, args.docs, args.seed, args.pool), sys.stdout)
+    elif args.mode == 'list':
+        # The items are rendered separately, so they get their own
+        # comments and quoting; then they are indented into a List.
+        items = generate(resources, args.items, args.seed, args.pool)
+        sys.stdout.write('---\nkind: List\nitems:\n')
+        for item in items:
+            lines = item.splitlines()[1:] # drop the '---'
+            sys.stdout.write('- ' + '\n  '.join(lines) + '\n')
+    elif args.mode == 'helm':
+        write_stream(generate(helm_releases(args.depth), args.releases, args.seed, args.pool), sys.stdout)
+
+if __name__ == '__main__':
+    main()
@@ -156,8 +156,9 @@ def controller_resources(draw):
     container_names = draw(strats.sets(min_size=1, max_size=5, elements=dns_labels))
     initcontainer_names = draw(strats.sets(min_size=1, max_size=5, elements=dns_labels))
     assume(len(container_names & initcontainer_names)==0)
-    containers = list(map(lambda n: container(n, draw(images_with_tag)), container_names))
-    initcontainers = list(map(lambda n: container(n, draw(images_with_tag)), initcontainer_names))
+    # NB sorted, so that the order doesn't depend on string hashing
+    containers = list(map(lambda n: container(n, draw(images_with_tag)), sorted(container_names)))
+    initcontainers = list(map(lambda n: container(n, draw(images_with_tag)), sorted(initcontainer_names)))
     podtemplate = {'template': {'spec': {'containers': containers, 'initContainers': initcontainers}}}
 
     if base['kind'] == 'CronJob':
@@ -301,6 +302,31 @@ class Spec:
     def __repr__(self):
         return "Spec(kind=%s,name=%s,namespace=%s)" % (self.kind, self.name, self.namespace)
 
+def image_spec(container='app', image='app:v2', namespace='default', name='foo'):
+    """The args for updating the image of a container in a Deployment,
+    by default the `app` container in deployment_yaml."""
+    spec = Spec(kind='Deployment', namespace=namespace, name=name)
+    spec.container, spec.image = container, image
+    return spec
+
+# A Deployment for tests that update an image, without needing to
+# generate manifests
+deployment_yaml = '''---
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: foo
+  namespace: default
+spec:
+  template:
+    spec:
+      containers:
+      - name: app # the main container
+        image: app:v1
+      - name: sidecar
+        image: sidecar:v1
+'''
+
 @given(workload_resources)
 def test_match_self(man):
     spec = Spec.from_resource(man)
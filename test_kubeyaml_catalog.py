@@ -0,0 +1,49 @@
+import kubeyaml
+
+index = {
+    'commit': '0' * 40,
+    'files': {
+        'apps/foo.yaml': {'blob': None, 'workloads': [
+            {'id': 'default:deployment/foo', 'doc': 0, 'item': None,
+             'containers': [['app', 'foo:v1'], ['sidecar', 'proxy:v1']]},
+            {'id': 'ns:cronjob/foo', 'doc': 1, 'item': 2,
+             'containers': [['job', 'foo:v1']]},
+        ]},
+        'apps/bar.yaml': {'blob': None, 'workloads': [
+            {'id': 'ns:helmrelease/bar', 'doc': 0, 'item': None,
+             'containers': [['chart-image', 'bar:v2']]},
+        ]},
+    },
+}
+
+def check_catalog(catalog):
+    assert len(catalog) == 3
+    foo = catalog.lookup('Deployment', 'default', 'foo')
+    assert (foo.path, foo.doc, foo.item) == ('apps/foo.yaml', 0, None)
+    assert foo.containers == [('app', 'foo:v1'), ('sidecar', 'proxy:v1')]
+    job = catalog.lookup('cronjob', 'ns', 'foo')
+    assert (job.kind, job.path, job.doc, job.item) == ('cronjob', 'apps/foo.yaml', 1, 2)
+    assert catalog.lookup('HelmRelease', 'ns', 'bar').containers == [('chart-image', 'bar:v2')]
+    assert catalog.lookup('Deployment', 'ns', 'foo') is None
+    assert sorted(w.name for w in catalog) == ['bar', 'foo', 'foo']
+
+def test_catalog():
+    check_catalog(kubeyaml.Catalog(kubeyaml.catalog_bytes(index)))
+
+def test_catalog_file(tmp_path):
+    path = tmp_path / 'catalog'
+    path.write_bytes(kubeyaml.catalog_bytes(index))
+    catalog = kubeyaml.Catalog.open(str(path))
+    check_catalog(catalog)
+    catalog.close()
+
+def test_strings_interned():
+    data = kubeyaml.catalog_bytes(index)
+    # 'foo:v1' and 'apps/foo.yaml' each appear twice, but are stored once
+    assert data.count(b'foo:v1') == 1
+    assert data.count(b'apps/foo.yaml') == 1
+
+def test_empty_catalog():
+    catalog = kubeyaml.Catalog(kubeyaml.catalog_bytes({'files': {}}))
+    assert len(catalog) == 0
+    assert catalog.lookup('Deployment', 'default', 'foo') is None
@@ -0,0 +1,37 @@
+import bz2
+import gzip
+import io
+import lzma
+import kubeyaml
+from test_kubeyaml import image_spec, deployment_yaml as document
+
+formats = {
+    'gzip': (gzip.compress, gzip.decompress),
+    'bz2': (bz2.compress, bz2.decompress),
+    'xz': (lzma.compress, lzma.decompress),
+}
+
+def image_update(docs):
+    return kubeyaml.update_image(image_spec(), docs)
+
+def test_compressed_streams():
+    for fmt, (compress, decompress) in formats.items():
+        infile, detected = kubeyaml.open_input(io.BytesIO(compress(document.encode('utf-8'))))
+        assert detected == fmt
+        out = io.BytesIO()
+        outfile = kubeyaml.open_output(out, fmt)
+        kubeyaml.apply_to_yaml(image_update, infile, outfile)
+        outfile.close()
+        assert decompress(out.getvalue()).decode('utf-8') == document.replace('app:v1', 'app:v2')
+
+def test_uncompressed_stream():
+    infile, fmt = kubeyaml.open_input(io.BytesIO(document.encode('utf-8')))
+    assert fmt is None
+    assert infile.read() == document
+
+def test_edit_compressed_file(tmp_path):
+    path = tmp_path / 'deploy.yaml.gz'
+    path.write_bytes(gzip.compress(document.encode('utf-8')))
+    errors = kubeyaml.edit_file(str(path), [image_update])
+    assert errors == [None]
+    assert gzip.decompress(path.read_bytes()).decode('utf-8') == document.replace('app:v1', 'app:v2')
@@ -0,0 +1,17 @@
+import kubeyaml
+import kubeyaml_gen
+from test_kubeyaml import documents
+
+def test_generate_deterministic():
+    gen1 = list(kubeyaml_gen.generate(documents, 30, 1, 10))
+    gen2 = list(kubeyaml_gen.generate(documents, 30, 1, 10))
+    assert gen1 == gen2
+
+def test_generate_count_and_names():
+    docs = list(kubeyaml.yaml().load_all(''.join(kubeyaml_gen.generate(documents, 30, 2, 10))))
+    assert len(docs) == 30
+    # the copies beyond the pool are renamed, so they don't clash
+    # with the originals
+    for i, doc in enumerate(docs[10:]):
+        for m in kubeyaml.manifests(doc):
+            assert m['metadata']['name'].endswith('-%d' % (i + 10))
@@ -0,0 +1,114 @@
+import subprocess
+import kubeyaml
+
+deployment = '''---
+kind: Deployment
+metadata:
+  name: %s
+spec:
+  template:
+    spec:
+      containers:
+      - name: app
+        image: %s
+'''
+
+service = '''---
+kind: Service
+metadata:
+  name: foo
+'''
+
+def git(repo, *args):
+    subprocess.run(['git', '-C', str(repo), '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+                   + list(args), check=True, stdout=subprocess.DEVNULL)
+
+def make_repo(tmp_path):
+    git(tmp_path, 'init', '-q')
+    (tmp_path / 'foo.yaml').write_text(deployment % ('foo', 'foo:v1') + service)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'bar.yml').write_text(deployment % ('bar', 'bar:v1'))
+    (tmp_path / 'README.md').write_text('not YAML')
+    git(tmp_path, 'add', '.')
+    git(tmp_path, 'commit', '-q', '-m', 'initial')
+
+def images(index):
+    return {w['id']: w['containers'] for f in index['files'].values() for w in f['workloads']}
+
+def test_index_incremental(tmp_path):
+    make_repo(tmp_path)
+    repo = str(tmp_path)
+    index, changed = kubeyaml.update_index(repo)
+    assert sorted(changed) == ['foo.yaml', 'sub/bar.yml']
+    assert images(index) == {
+        'default:deployment/foo': [['app', 'foo:v1']],
+        'default:deployment/bar': [['app', 'bar:v1']],
+    }
+    assert index['files']['foo.yaml']['workloads'][0]['doc'] == 0
+
+    # nothing changed, nothing read
+    index, changed = kubeyaml.update_index(repo, index)
+    assert changed == []
+
+    # a change in the working tree is picked up, and read again once
+    # it's committed (since what's committed may differ)
+    (tmp_path / 'foo.yaml').write_text(deployment % ('foo', 'foo:v2'))
+    index, changed = kubeyaml.update_index(repo, index)
+    assert changed == ['foo.yaml']
+    assert images(index)['default:deployment/foo'] == [['app', 'foo:v2']]
+    git(tmp_path, 'commit', '-q', '-a', '-m', 'update foo')
+    index, changed = kubeyaml.update_index(repo, index)
+    assert changed == ['foo.yaml']
+    index, changed = kubeyaml.update_index(repo, index)
+    assert changed == []
+
+    # deleted files are dropped
+    git(tmp_path, 'rm', '-q', 'sub/bar.yml')
+    index, changed = kubeyaml.update_index(repo, index)
+    assert list(index['files']) == ['foo.yaml']
+
+def test_index_from_git(tmp_path):
+    make_repo(tmp_path)
+    repo = str(tmp_path)
+    # the working tree is ignored
+    (tmp_path / 'foo.yaml').write_text(deployment % ('foo', 'foo:v2'))
+    index, changed = kubeyaml.update_index(repo, rev='HEAD')
+    assert sorted(changed) == ['foo.yaml', 'sub/bar.yml']
+    assert images(index)['default:deployment/foo'] == [['app', 'foo:v1']]
+
+    git(tmp_path, 'commit', '-q', '-a', '-m', 'update foo')
+    index, changed = kubeyaml.update_index(repo, index, rev='HEAD')
+    assert changed == ['foo.yaml']
+    assert images(index)['default:deployment/foo'] == [['app', 'foo:v2']]
+
+def test_index_subdirectory(tmp_path):
+    make_repo(tmp_path)
+    repo = str(tmp_path / 'sub')
+    index, changed = kubeyaml.update_index(repo)
+    assert changed == ['bar.yml']
+
+    # paths from git are relative to the subdirectory, including
+    # those of files changed only in the working tree
+    (tmp_path / 'sub' / 'bar.yml').write_text(deployment % ('bar', 'bar:v2'))
+    index, changed = kubeyaml.update_index(repo, index)
+    assert changed == ['bar.yml']
+    assert images(index) == {'default:deployment/bar': [['app', 'bar:v2']]}
+
+    index, changed = kubeyaml.update_index(repo, rev='HEAD')
+    assert images(index) == {'default:deployment/bar': [['app', 'bar:v1']]}
+
+def test_index_skips_what_it_cannot_read(tmp_path):
+    make_repo(tmp_path)
+    (tmp_path / 'latin1.yaml').write_bytes('kind: ConfigMap\nmetadata:\n  name: café\n'.encode('latin-1'))
+    # an item that isn't a workload doesn't stop the rest of the List
+    # being indexed
+    (tmp_path / 'list.yaml').write_text('kind: List\nitems:\n' + ''.join(
+        '- ' + '\n  '.join((deployment % (name, image)).splitlines()[1:]) + '\n'
+        for name, image in [('noimage', 'x'), ('baz', 'baz:v1')]).replace('image: x', 'args: []'))
+    git(tmp_path, 'add', '.')
+    git(tmp_path, 'commit', '-q', '-m', 'more')
+    for rev in [None, 'HEAD']:
+        index, changed = kubeyaml.update_index(str(tmp_path), rev=rev)
+        assert index['files']['latin1.yaml']['workloads'] == []
+        assert images(index)['default:deployment/baz'] == [['app', 'baz:v1']]
+        assert 'default:deployment/noimage' not in images(index)
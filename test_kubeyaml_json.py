@@ -0,0 +1,65 @@
+import io
+import json
+import kubeyaml
+from ruamel.yaml.compat import StringIO
+from test_kubeyaml import image_spec, deployment_yaml
+
+deployment = kubeyaml.plain(kubeyaml.yaml().load(deployment_yaml))
+
+def image_update(docs):
+    return kubeyaml.update_image(image_spec(), docs)
+
+def apply(text):
+    out = StringIO()
+    kubeyaml.apply_to_json(image_update, StringIO(text), out)
+    return out.getvalue()
+
+def test_styles_preserved():
+    lst = {'kind': 'List', 'items': [deployment]}
+    for doc in [deployment, lst]:
+        for style in [dict(indent=2), dict(indent=4), dict(indent='\t'),
+                      dict(), dict(separators=(',', ':')),
+                      dict(indent=2, separators=(',', ':'))]:
+            text = json.dumps(doc, **style) + '\n'
+            assert apply(text) == text.replace('app:v1', 'app:v2'), style
+
+def test_non_ascii_and_final_newline():
+    doc = dict(deployment, metadata={'name': 'foo', 'namespace': 'default',
+                                     'annotations': {'note': 'caf\u00e9'}})
+    for text in [json.dumps(doc), json.dumps(doc, ensure_ascii=False),
+                 json.dumps(doc, indent=2) + '\n']:
+        assert apply(text) == text.replace('app:v1', 'app:v2'), text
+
+def test_multiple_documents():
+    other = dict(deployment, metadata={'name': 'bar'})
+    text = json.dumps(other) + '\n' + json.dumps(deployment) + '\n'
+    assert apply(text) == json.dumps(other) + '\n' + \
+        json.dumps(deployment).replace('app:v1', 'app:v2') + '\n'
+
+def test_not_json_after_all():
+    # this is YAML (in flow style), but not JSON
+    text = '{kind: Deployment, metadata: {name: foo}, spec: {template: {spec: {containers: [{name: app, image: app:v1}]}}}}\n'
+    out = apply(text)
+    assert out.startswith('--- {kind: Deployment')
+    assert 'app:v2' in out
+
+def test_looks_like_json():
+    assert kubeyaml.looks_like_json(io.BufferedReader(io.BytesIO(b'  \n{"kind": "List"}')))
+    assert not kubeyaml.looks_like_json(io.BufferedReader(io.BytesIO(b'---\nkind: List\n')))
+
+def test_edit_json_file(tmp_path):
+    path = tmp_path / 'deploy.json'
+    text = json.dumps(deployment, indent=2) + '\n'
+    path.write_text(text)
+    assert kubeyaml.edit_file(str(path), [image_update]) == [None]
+    assert path.read_text() == text.replace('app:v1', 'app:v2')
+
+def test_max_memory():
+    # any process is over a limit this small
+    try:
+        kubeyaml.apply_to_json(image_update, StringIO(json.dumps(deployment)), StringIO(),
+                               max_memory=1024)
+    except kubeyaml.MemoryLimitExceeded:
+        pass
+    else:
+        assert False, "MemoryLimitExceeded not raised"
@@ -0,0 +1,54 @@
+import json
+import kubeyaml
+from ruamel.yaml.compat import StringIO
+from test_kubeyaml import Spec, image_spec
+
+stream = '''---
+kind: Service
+metadata:
+  name: foo
+---
+kind: DeploymentList
+items:
+- kind: Deployment
+  metadata:
+    name: foo # the deployment
+    namespace: ns
+  spec:
+    template:
+      spec:
+        containers:
+        - name: app
+          image: app:v1
+'''
+
+def changes(args, fn, style):
+    out = StringIO()
+    kubeyaml.apply_to_yaml_changes(lambda docs: fn(args, docs), args,
+                                   StringIO(stream), out, style)
+    return out.getvalue()
+
+def test_json_patch():
+    before = {'a': {'b': 1, 'c/d': [1, 2]}, 'e': 'f'}
+    after = {'a': {'c/d': [1, 3]}, 'e': 'f', 'g': True}
+    assert kubeyaml.json_patch(before, after) == [
+        {'op': 'remove', 'path': '/a/b'},
+        {'op': 'replace', 'path': '/a/c~1d/1', 'value': 3},
+        {'op': 'add', 'path': '/g', 'value': True},
+    ]
+
+def test_image_json_patch():
+    out = changes(image_spec(namespace='ns'), kubeyaml.update_image, 'json-patch')
+    assert json.loads(out) == {
+        'id': 'ns:deployment/foo',
+        'patch': [{'op': 'replace', 'path': '/spec/template/spec/containers/0/image', 'value': 'app:v2'}],
+    }
+
+def test_annotate_diff():
+    args = Spec(kind='Deployment', namespace='ns', name='foo')
+    args.notes = [('fluxcd.io/automated', 'true')]
+    out = changes(args, kubeyaml.update_annotations, 'diff')
+    assert out.startswith('--- a/ns:deployment/foo\n+++ b/ns:deployment/foo\n')
+    added = [l for l in out.splitlines() if l.startswith('+') and not l.startswith('+++')]
+    assert added == ['+  annotations:', "+    fluxcd.io/automated: 'true'"]
+    assert [l for l in out.splitlines() if l.startswith('-') and not l.startswith('---')] == []
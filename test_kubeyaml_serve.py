@@ -0,0 +1,121 @@
+import asyncio
+import kubeyaml
+from test_kubeyaml import image_spec, deployment_yaml as deployment
+
+def edit(args):
+    return lambda docs: kubeyaml.update_image(args, docs)
+
+def test_coalesce_edits(tmp_path, monkeypatch):
+    path = tmp_path / 'deploy.yaml'
+    path.write_text(deployment)
+
+    batches = []
+    original_edit_file = kubeyaml.edit_file
+    def edit_file(path, fns):
+        batches.append(len(fns))
+        return original_edit_file(path, fns)
+    monkeypatch.setattr(kubeyaml, 'edit_file', edit_file)
+
+    missing = image_spec('app', 'app:v2')
+    missing.name = 'bar'
+
+    async def run():
+        queue = kubeyaml.EditQueue()
+        results = [
+            queue.submit(str(path), edit(image_spec('app', 'app:v2'))),
+            queue.submit(str(path), edit(missing)),
+            queue.submit(str(path), edit(image_spec('sidecar', 'sidecar:v2'))),
+        ]
+        return await asyncio.gather(*results, return_exceptions=True)
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+    assert batches == [3]
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], kubeyaml.NotFound)
+    assert path.read_text() == deployment.replace(':v1', ':v2')
+
+def test_failed_edit_has_no_effect(tmp_path):
+    path = tmp_path / 'deploy.yaml'
+    path.write_text(deployment)
+
+    def rename_then_fail(docs):
+        for doc in docs:
+            doc['metadata']['name'] = 'bar'
+            yield doc
+        raise kubeyaml.UnresolvablePath(['spec.nonesuch'])
+
+    errors = kubeyaml.edit_file(str(path), [
+        rename_then_fail,
+        edit(image_spec('app', 'app:v2')),
+    ])
+    assert isinstance(errors[0], kubeyaml.UnresolvablePath)
+    assert errors[1] is None
+    assert path.read_text() == deployment.replace('app:v1', 'app:v2')
+
+def test_edit_file_leaves_no_trace(tmp_path):
+    path = tmp_path / 'deploy.yaml'
+    path.write_text(deployment)
+    path.chmod(0o600)
+    kubeyaml.edit_file(str(path), [edit(image_spec('app', 'app:v2'))])
+    assert path.stat().st_mode & 0o777 == 0o600
+
+    # a file that can't be parsed is left as it is, and so is the
+    # directory
+    path.write_text('kind: [unclosed')
+    from ruamel.yaml.error import YAMLError
+    try:
+        kubeyaml.edit_file(str(path), [edit(image_spec('app', 'app:v2'))])
+        assert False, "expected a parse error"
+    except YAMLError:
+        pass
+    assert path.read_text() == 'kind: [unclosed'
+    assert [p.name for p in tmp_path.iterdir()] == ['deploy.yaml']
+
+def test_stream_options_rejected(tmp_path):
+    import json
+    path = tmp_path / 'deploy.yaml'
+    path.write_text(deployment)
+    args = ['image', '--namespace', 'default', '--kind', 'Deployment', '--name', 'foo',
+            '--container', 'app', '--image', 'app:v2']
+
+    async def run(extra):
+        line = json.dumps({'id': 1, 'file': str(path), 'args': args + extra})
+        return await kubeyaml.handle_edit(kubeyaml.EditQueue(), line)
+
+    loop = asyncio.new_event_loop()
+    try:
+        response = loop.run_until_complete(run(['--verify', '--output', 'diff']))
+        assert response == {'id': 1, 'ok': False,
+                            'error': 'not supported in serve mode: --output --verify'}
+        assert path.read_text() == deployment
+        response = loop.run_until_complete(run([]))
+        assert response == {'id': 1, 'ok': True}
+    finally:
+        loop.close()
+    assert path.read_text() == deployment.replace('app:v1', 'app:v2')
+
+def test_argument_errors_in_response(tmp_path, capsys):
+    import json
+
+    async def run(args):
+        line = json.dumps({'id': 1, 'file': str(tmp_path / 'deploy.yaml'), 'args': args})
+        return await kubeyaml.handle_edit(kubeyaml.EditQueue(), line)
+
+    loop = asyncio.new_event_loop()
+    try:
+        response = loop.run_until_complete(run(['image', '--help']))
+        assert not response['ok']
+        assert response['error'].startswith('usage:')
+        assert '--container CONTAINER' in response['error']
+        response = loop.run_until_complete(run(['image', '--namespace', 'default']))
+        assert not response['ok']
+        assert 'error: the following arguments are required' in response['error']
+    finally:
+        loop.close()
+    # nothing is printed by the server
+    assert capsys.readouterr() == ('', '')
@@ -0,0 +1,85 @@
+import tracemalloc
+import kubeyaml
+from ruamel.yaml.compat import StringIO
+
+document = '''---
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: foo-%d
+  namespace: default
+spec:
+  template:
+    spec:
+      containers:
+      - name: app # the main container
+        image: app:v1
+'''
+
+class Sink(object):
+    """An outfile that counts, but doesn't keep, what's written."""
+    def __init__(self):
+        self.written = 0
+
+    def write(self, s):
+        self.written += len(s)
+
+    def flush(self):
+        pass
+
+class FlushRecorder(Sink):
+    """Records how much had been written at each flush."""
+    def __init__(self):
+        super(FlushRecorder, self).__init__()
+        self.flushes = []
+
+    def flush(self):
+        self.flushes.append(self.written)
+
+def stream(count):
+    return StringIO(''.join(document % i for i in range(count)))
+
+def ident(docs):
+    for d in docs:
+        yield d
+
+def peak_memory(count):
+    infile = stream(count)
+    tracemalloc.start()
+    try:
+        kubeyaml.apply_to_yaml(ident, infile, Sink())
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_memory_independent_of_document_count():
+    peak_memory(1) # so that imports etc. aren't counted
+    small, large = peak_memory(100), peak_memory(1000)
+    assert large < small * 1.5, (small, large)
+
+def test_flush_per_document():
+    out = FlushRecorder()
+    kubeyaml.apply_to_yaml(ident, stream(5), out)
+    # the output is flushed as it goes, rather than all at the end
+    assert len(out.flushes) >= 5
+    assert 0 < out.flushes[0] < out.written
+
+def peak_rss():
+    import resource, sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def test_max_memory():
+    kubeyaml.apply_to_yaml(ident, stream(5), Sink()) # so that imports etc. are done
+    peak = peak_rss()
+    # a limit the process is already over is exceeded ...
+    try:
+        kubeyaml.apply_to_yaml(ident, stream(5), Sink(), max_memory=peak - 1)
+    except kubeyaml.MemoryLimitExceeded:
+        pass
+    else:
+        assert False, "MemoryLimitExceeded not raised"
+    # ... while one with room to spare is not
+    out = Sink()
+    kubeyaml.apply_to_yaml(ident, stream(5), out, max_memory=peak + 64 * 1024 * 1024)
+    assert out.written > 0
@@ -0,0 +1,142 @@
+import json
+import kubeyaml
+from ruamel.yaml.compat import StringIO
+from test_kubeyaml import Spec, image_spec
+
+stream = '''# leading comment
+kind: Service
+metadata:
+  name: foo
+
+---
+kind: DeploymentList
+items:
+- kind: Deployment
+  metadata:
+    name: foo # the one to edit
+    namespace: ns
+  spec:
+    template:
+      spec:
+        containers:
+        - name: app
+          image: app:v1
+- kind: Deployment
+  metadata:
+    name: bar
+    namespace: ns
+  spec:
+    template:
+      spec:
+        containers:
+        - name: app
+          image: app:v1
+...
+---
+kind: ConfigMap
+metadata:
+  name: foo
+'''
+
+def verified(fn, text=stream, apply=kubeyaml.apply_to_yaml):
+    args = image_spec(namespace='ns')
+    verify = kubeyaml.Verifier(args, kubeyaml.verify_image)
+    apply(lambda docs: fn(args, docs), StringIO(text), StringIO(), verify=verify)
+
+def fails(fn, text=stream, apply=kubeyaml.apply_to_yaml):
+    try:
+        verified(fn, text, apply)
+    except kubeyaml.VerificationFailed as e:
+        return e.args[0]
+    assert False, "VerificationFailed not raised"
+
+def and_then(alter):
+    """Update the image, then alter the documents some other way"""
+    def fn(args, docs):
+        for i, doc in enumerate(kubeyaml.update_image(args, docs)):
+            alter(i, doc)
+            yield doc
+    return fn
+
+def test_verify_edit():
+    verified(kubeyaml.update_image)
+
+def test_verify_reformatted_document():
+    # ruamel.yaml doesn't keep the indentation of sequences, or extra
+    # spaces, so the service is written differently; but its values
+    # are the same, so it's not counted as changed
+    service = '''%YAML 1.2
+---
+kind: Service
+metadata:
+  name:    foo
+spec:
+  ports:
+    - port: 80
+      name: http
+'''
+    text = service + stream.replace('# leading comment\n', '---\n')
+    verified(kubeyaml.update_image, text)
+    def alter(i, doc):
+        if i == 0:
+            doc['spec']['ports'][0]['port'] = 81
+    assert fails(and_then(alter), text) == "document 0 was changed"
+
+def test_verify_parses_only_documents_that_differ(monkeypatch):
+    loads = []
+    original_yaml = kubeyaml.yaml
+    def yaml():
+        y = original_yaml()
+        load = y.load
+        def counted(text):
+            loads.append(text)
+            return load(text)
+        y.load = counted
+        return y
+    monkeypatch.setattr(kubeyaml, 'yaml', yaml)
+    verified(kubeyaml.update_image)
+    assert loads == []
+    # ruamel.yaml doesn't keep the indentation of the sequence in the
+    # first document, so that document (alone) is parsed again, from
+    # the input and from the output
+    verified(kubeyaml.update_image, stream.replace('kind: Service', 'kind: Service\nports:\n  - 80'))
+    assert len(loads) == 2
+
+def test_verify_other_document_changed():
+    def alter(i, doc):
+        if i == 2:
+            doc['metadata']['name'] = 'baz'
+    assert fails(and_then(alter)) == "document 2 was changed"
+
+def test_verify_other_item_changed():
+    def alter(i, doc):
+        if i == 1:
+            doc['items'][1]['metadata']['name'] = 'baz'
+    assert fails(and_then(alter)) == "item 1 of document 1 was changed"
+
+def test_verify_value_not_set():
+    def no_op(args, docs):
+        for doc in docs:
+            yield doc
+    assert fails(no_op) == "document 1 does not have the value(s) requested"
+
+def test_verify_json():
+    text = ''.join(json.dumps(doc) + '\n' for doc in kubeyaml.yaml().load_all(stream))
+    verified(kubeyaml.update_image, text, kubeyaml.apply_to_json)
+    def alter(i, doc):
+        if i == 0:
+            doc['metadata']['name'] = 'baz'
+    assert fails(and_then(alter), text, kubeyaml.apply_to_json) == "document 0 was changed"
+
+def test_verify_annotations_and_paths():
+    man = {'kind': 'Deployment', 'metadata': {'name': 'foo', 'annotations': {'a': 'b'}},
+           'spec': {'replicas': '3'}}
+    args = Spec()
+    args.notes = [('a', 'b'), ('c', '')]
+    assert kubeyaml.verify_annotations(args, man)
+    args.notes = [('a', '')]
+    assert not kubeyaml.verify_annotations(args, man)
+    args.paths = [('spec.replicas', '3')]
+    assert kubeyaml.verify_paths(args, man)
+    args.paths = [('spec.replicas.nonesuch', '3')]
+    assert not kubeyaml.verify_paths(args, man)